@@ -1,30 +1,82 @@
+import asyncio
+import logging
 import os
-from datetime import datetime, date, time as dtime
-from io import BytesIO
-from typing import Optional
-
-from fastapi import FastAPI, HTTPException, Query
+import tempfile
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime, date, date as dt_date, time as dtime, timezone
+from operator import itemgetter
+from typing import List, Optional
+
+from cachetools import TTLCache, cached
+from fastapi import Body, FastAPI, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel, Field
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError, field_validator
+from pymongo.errors import BulkWriteError
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+import orjson
+
+try:
+    import xlsxwriter
+    _HAS_XLSX = True
+except ImportError:
+    _HAS_XLSX = False
+
+from database import (
+    create_document_async,
+    create_documents_async,
+    get_documents_cursor_async,
+    async_db,
+    db,
+)
+
+logger = logging.getLogger(__name__)
+
+async def ensure_indexes():
+    # list/export filter on date + shift; without this every query is a collection scan
+    if async_db is None:
+        return
+    try:
+        await async_db["productionrecord"].create_index([("date", 1), ("shift", 1)], name="date_shift_idx", background=True)
+    except Exception as e:
+        # keep serving (so /test can report the problem) when Mongo is unreachable
+        logger.warning("Could not create productionrecord indexes: %s", e)
 
-from database import create_document, get_documents, db
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # run in the background: an unreachable server would otherwise hold up
+    # startup for the whole server selection timeout
+    task = asyncio.create_task(ensure_indexes())
+    yield
+    task.cancel()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# Comma-separated allowlist, e.g. "https://app.example.com,http://localhost:3000".
+# Without one, fall back to "*"; browsers reject credentialed responses for a
+# wildcard origin, so credentials are only allowed with an explicit allowlist.
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=CORS_ORIGINS or ["*"],
+    allow_credentials=bool(CORS_ORIGINS),
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type", "Authorization"],
 )
 
 
 class ProductionInput(BaseModel):
-    # Use Optional with string forward refs to avoid evaluation issues in class scope
-    date: Optional['date'] = None
-    time: Optional['dtime'] = None
+    model_config = ConfigDict(extra='forbid')
+
+    # pydantic resolves annotations against the class namespace, where `date`
+    # is this field's default (None); the dt_date alias avoids that clash
+    date: Optional[dt_date] = None
+    time: Optional[dtime] = None
     shift: Optional[str] = None
     line: Optional[str] = None
     product: Optional[str] = None
@@ -34,10 +86,55 @@ class ProductionInput(BaseModel):
     notes: Optional[str] = None
 
 
-class ProductionRecord(ProductionInput):
-    date: 'date'
-    time: Optional['dtime']
-    shift: str
+class ProductionOut(BaseModel):
+    """
+    Production record as returned by GET /api/production.
+    Converts the stored representation (see schemas.Productionrecord) back
+    into API types; kept here rather than in schemas.py since it is not a
+    collection. Every field is optional because documents can also be
+    edited through the database viewer and are not guaranteed complete.
+    """
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: Optional[str] = Field(None, alias="_id")
+    date: Optional[dt_date] = None  # dt_date: see ProductionInput
+    time: Optional[str] = None
+    shift: Optional[str] = None
+    line: Optional[str] = None
+    product: Optional[str] = None
+    operator: Optional[str] = None
+    count: Optional[int] = None
+    defects: Optional[int] = None
+    notes: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+    @field_validator("id", mode="before")
+    @classmethod
+    def _object_id_to_str(cls, v):
+        return None if v is None else str(v)
+
+    @field_validator("date", mode="before")
+    @classmethod
+    def _midnight_to_date(cls, v):
+        return v.date() if isinstance(v, datetime) else v
+
+    @field_validator("time", mode="before")
+    @classmethod
+    def _hms_to_hm(cls, v):
+        return _hm(v)
+
+    @field_validator("created_at", "updated_at", mode="before")
+    @classmethod
+    def _naive_is_utc(cls, v):
+        # pymongo returns naive datetimes that are UTC
+        if isinstance(v, datetime) and v.tzinfo is None:
+            return v.replace(tzinfo=timezone.utc)
+        return v
+
+
+# Built once; validation and JSON encoding both run in pydantic-core
+_PRODUCTION_OUT = TypeAdapter(ProductionOut)
 
 
 @app.get("/")
@@ -45,8 +142,23 @@ def read_root():
     return {"message": "Production Tracking API"}
 
 
+# Health probes hit /test every few seconds; only enumerate collections once per TTL
+_collections_cache = TTLCache(maxsize=1, ttl=5.0)
+_last_collections: list = []
+
+
+@cached(_collections_cache, lock=threading.Lock())
+def _list_collections() -> list:
+    global _last_collections
+    _last_collections = db.list_collection_names()[:10]
+    return _last_collections
+
+
 @app.get("/test")
-def test_database():
+def test_database(http_response: Response):
+    # let proxies answer repeated probes for as long as the collection cache holds
+    http_response.headers["Cache-Control"] = "public, max-age=5"
+
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -63,10 +175,11 @@ def test_database():
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
-                response["collections"] = collections[:10]
+                response["collections"] = _list_collections()
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
+                # report the error, but keep showing the last known collections
+                response["collections"] = _last_collections
                 response["database"] = f"⚠️  Connected but Error: {str(e)[:50]}"
         else:
             response["database"] = "⚠️  Available but not initialized"
@@ -78,24 +191,62 @@ def test_database():
     return response
 
 
+# BSON has no date or time-of-day types, so production records store the date
+# as a datetime at midnight and the time as an "HH:MM:SS" string (see
+# schemas.Productionrecord). Queries must use the same representation.
+def to_bson_date(d: date) -> datetime:
+    return datetime.combine(d, dtime.min)
+
+
+def to_bson_time(t: dtime) -> str:
+    return f"{t.hour:02d}:{t.minute:02d}:{t.second:02d}"
+
+
+# Fixed-format f-strings are several times cheaper than strftime/isoformat in
+# per-row loops. _ymd accepts a date or datetime and drops any time part.
+def _ymd(d: date) -> str:
+    return f"{d.year:04d}-{d.month:02d}-{d.day:02d}"
+
+
+def _hm(v):
+    """HH:MM for a stored time: normally an "HH:MM:SS" string, but documents
+    edited through the database viewer may hold a time or datetime instead"""
+    if isinstance(v, str):
+        return v[:5]
+    if isinstance(v, (dtime, datetime)):
+        return f"{v.hour:02d}:{v.minute:02d}"
+    return v
+
+
+def _parse_ymd(s: str) -> date:
+    """Parse a YYYY-MM-DD string without going through strptime"""
+    y, m, d = s[0:4], s[5:7], s[8:10]
+    # isascii + isdigit rejects signs, whitespace and non-ASCII digits that int() accepts
+    if (len(s) != 10 or s[4] != '-' or s[7] != '-' or not s.isascii()
+            or not (y.isdigit() and m.isdigit() and d.isdigit())):
+        raise ValueError(f"invalid date: {s!r}")
+    return date(int(y), int(m), int(d))
+
+
 # Utility to compute shift based on time
-FIRST_SHIFT_START = dtime(7, 0)
-FIRST_SHIFT_END = dtime(15, 30)  # exclusive upper bound for A
-SECOND_SHIFT_START = dtime(15, 30)
-SECOND_SHIFT_END = dtime(23, 59, 59)
+# Shift boundaries in seconds since midnight
+_A_LO = 7 * 3600                   # 07:00
+_A_HI = 15 * 3600 + 30 * 60        # 15:30, exclusive upper bound for A
+_B_HI = 23 * 3600 + 59 * 60 + 59   # 23:59:59
 
 
 def compute_shift(entry_time: dtime) -> str:
-    if entry_time >= FIRST_SHIFT_START and entry_time < FIRST_SHIFT_END:
+    # microseconds are dropped, so e.g. 23:59:59.5 falls in B
+    s = entry_time.hour * 3600 + entry_time.minute * 60 + entry_time.second
+    if _A_LO <= s < _A_HI:
         return "A"
-    if entry_time >= SECOND_SHIFT_START and entry_time <= SECOND_SHIFT_END:
+    if _A_HI <= s <= _B_HI:
         return "B"
     raise HTTPException(status_code=400, detail="Time outside defined shifts (A: 07:00-15:30, B: 15:30-24:00)")
 
 
-@app.post("/api/production")
-def create_production(record: ProductionInput):
-    now = datetime.now()
+def _build_doc(record: ProductionInput, now: datetime) -> dict:
+    """Fill in date/time/shift defaults and build the stored document"""
     rec_date: date = record.date or now.date()
     rec_time: Optional[dtime] = record.time or dtime(now.hour, now.minute, now.second)
 
@@ -104,150 +255,250 @@ def create_production(record: ProductionInput):
         if rec_time is None:
             raise HTTPException(status_code=400, detail="time is required if shift not provided")
         rec_shift = compute_shift(rec_time)
-    else:
-        if rec_time is not None:
-            expected = compute_shift(rec_time)
-            if expected != rec_shift:
-                pass
-        if rec_shift not in ("A", "B"):
-            raise HTTPException(status_code=400, detail="shift must be 'A' or 'B'")
+    elif rec_shift not in ("A", "B"):
+        raise HTTPException(status_code=400, detail="shift must be 'A' or 'B'")
 
-    doc = ProductionRecord(
-        date=rec_date,
-        time=rec_time,
-        shift=rec_shift,
-        line=record.line,
-        product=record.product,
-        operator=record.operator,
-        count=record.count,
-        defects=record.defects or 0,
-        notes=record.notes,
-    ).model_dump()
+    # record is already validated and date/time/shift are filled in above;
+    # schemas.Productionrecord describes the stored shape
+    return {
+        "date": to_bson_date(rec_date),
+        "time": to_bson_time(rec_time),
+        "shift": rec_shift,
+        "line": record.line,
+        "product": record.product,
+        "operator": record.operator,
+        "count": record.count,
+        "defects": record.defects or 0,
+        "notes": record.notes,
+    }
+
+
+@app.post("/api/production")
+async def create_production(record: ProductionInput):
+    doc = _build_doc(record, datetime.now())
 
-    inserted_id = create_document("productionrecord", doc)
+    inserted_id = await create_document_async("productionrecord", doc)
 
     return {
         "status": "ok",
         "id": inserted_id,
-        "date": rec_date.isoformat(),
-        "shift": rec_shift,
+        "date": _ymd(doc["date"]),
+        "shift": doc["shift"],
         "message": "Production record saved"
     }
 
 
+BULK_MAX_RECORDS = 1000
+
+
+@app.post("/api/production/bulk")
+async def create_production_bulk(
+    records: List[ProductionInput] = Body(..., min_length=1, max_length=BULK_MAX_RECORDS),
+):
+
+    now = datetime.now()
+    docs = []
+    for i, record in enumerate(records):
+        try:
+            docs.append(_build_doc(record, now))
+        except HTTPException as e:
+            raise HTTPException(status_code=e.status_code, detail=f"record {i}: {e.detail}")
+
+    try:
+        ids = await create_documents_async("productionrecord", docs)
+    except BulkWriteError as e:
+        # unordered insert: the records without a write error were still saved
+        failed = sorted(err["index"] for err in e.details.get("writeErrors", []))
+        raise HTTPException(status_code=500, detail={
+            "message": "Some production records could not be saved",
+            "inserted": e.details.get("nInserted", 0),
+            "failed": len(failed),
+            "failed_records": failed,
+        })
+
+    return {
+        "status": "ok",
+        "count": len(ids),
+        "ids": ids,
+        "message": "Production records saved"
+    }
+
+
+_RECORD_FIELDS = ("date", "time", "shift", "line", "product", "operator", "count", "defects", "notes")
+
+# Only fetch the fields each endpoint actually emits
+_EXPORT_PROJECTION = {"_id": 0, **{f: 1 for f in _RECORD_FIELDS}}
+_LIST_PROJECTION = {"_id": 1, **{f: 1 for f in _RECORD_FIELDS}, "created_at": 1, "updated_at": 1}
+
+# Text columns of an export row, with "" for fields missing from the document
+_EXPORT_TEXT_DEFAULTS = {"shift": "", "line": "", "product": "", "operator": "", "notes": ""}
+_export_text_fields = itemgetter("shift", "line", "product", "operator", "notes")
+
+
 @app.get("/api/production")
-def list_production(
+async def list_production(
     date_str: Optional[str] = Query(default=None, description="Filter by date YYYY-MM-DD"),
     shift: Optional[str] = Query(default=None, description="Filter by shift A or B"),
+    fmt: str = Query(default="ndjson", alias="format", description="Response format: ndjson (default) or json"),
 ):
+    if fmt not in ("ndjson", "json"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'json'")
     filter_q = {}
     if date_str:
         try:
-            d = datetime.strptime(date_str, "%Y-%m-%d").date()
+            d = _parse_ymd(date_str)
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid date format, expected YYYY-MM-DD")
-        filter_q["date"] = d
+        filter_q["date"] = to_bson_date(d)
     if shift:
         if shift not in ("A", "B"):
             raise HTTPException(status_code=400, detail="shift must be 'A' or 'B'")
         filter_q["shift"] = shift
 
-    docs = get_documents("productionrecord", filter_q)
+    docs = get_documents_cursor_async("productionrecord", filter_q, projection=_LIST_PROJECTION, batch_size=500)
+
+    if fmt == "json":
+        return StreamingResponse(_iter_json_array(docs), media_type="application/json")
+    return StreamingResponse(_iter_ndjson(docs), media_type="application/x-ndjson")
+
+
+async def _encode_docs(docs):
+    """
+    Encode each document as JSON. This runs after the 200 and headers are sent,
+    so a document that does not fit ProductionOut must not end the stream; it
+    is sent unconverted rather than dropped, and the count is logged.
+    """
+    unconverted = 0
+    async for doc in docs:
+        try:
+            item = _PRODUCTION_OUT.dump_json(_PRODUCTION_OUT.validate_python(doc), by_alias=True)
+        except ValidationError as e:
+            unconverted += 1
+            logger.warning("Production record %s does not match ProductionOut, sending it unconverted: %s", doc.get("_id"), e)
+            item = orjson.dumps(doc, default=str, option=orjson.OPT_NAIVE_UTC)
+        yield item
+    if unconverted:
+        logger.warning("%d production record(s) in this listing were sent unconverted", unconverted)
+
+
+async def _iter_ndjson(docs):
+    """Yield one JSON document per line"""
+    async for item in _encode_docs(docs):
+        yield item + b"\n"
 
-    def to_jsonable(x: dict):
-        y = x.copy()
-        if "_id" in y:
-            y["_id"] = str(y["_id"])  # type: ignore
-        if isinstance(y.get("date"), date):
-            y["date"] = y["date"].isoformat()
-        if isinstance(y.get("time"), dtime):
-            y["time"] = y["time"].strftime("%H:%M")
-        if isinstance(y.get("created_at"), datetime):
-            y["created_at"] = y["created_at"].isoformat()
-        if isinstance(y.get("updated_at"), datetime):
-            y["updated_at"] = y["updated_at"].isoformat()
-        return y
 
-    return [to_jsonable(doc) for doc in docs]
+async def _iter_json_array(docs):
+    """Yield documents as a single JSON array, for clients that need plain JSON"""
+    yield b"["
+    sep = b""
+    async for item in _encode_docs(docs):
+        yield sep + item
+        sep = b","
+    yield b"]"
 
 
 @app.get("/api/production/export")
-def export_production(
+async def export_production(
     date_str: str = Query(..., description="Date YYYY-MM-DD"),
     shift: str = Query(..., description="Shift A or B"),
 ):
     if shift not in ("A", "B"):
         raise HTTPException(status_code=400, detail="shift must be 'A' or 'B'")
     try:
-        d = datetime.strptime(date_str, "%Y-%m-%d").date()
+        d = _parse_ymd(date_str)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format, expected YYYY-MM-DD")
 
-    records = get_documents("productionrecord", {"date": d, "shift": shift})
+    filter_q = {"date": to_bson_date(d), "shift": shift}
+    records = get_documents_cursor_async("productionrecord", filter_q, projection=_EXPORT_PROJECTION)
 
-    try:
-        from openpyxl import Workbook
-    except Exception:
+    if not _HAS_XLSX:
         raise HTTPException(status_code=500, detail="Excel engine not available. Contact administrator.")
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"{date_str}-Shift-{shift}"
-
     headers = [
         "Date", "Time", "Shift", "Line", "Product", "Operator", "Good Count", "Defects", "Notes"
     ]
-    ws.append(headers)
-
-    total_good = 0
-    total_def = 0
-
-    for r in records:
-        r_date = r.get("date")
-        r_time = r.get("time")
-        if isinstance(r_date, date):
-            r_date_str = r_date.isoformat()
-        else:
-            r_date_str = str(r_date)
-        if isinstance(r_time, dtime):
-            r_time_str = r_time.strftime("%H:%M")
-        else:
-            r_time_str = r_time or ""
-        ws.append([
-            r_date_str,
-            r_time_str,
-            r.get("shift", ""),
-            r.get("line", ""),
-            r.get("product", ""),
-            r.get("operator", ""),
-            int(r.get("count", 0) or 0),
-            int(r.get("defects", 0) or 0),
-            r.get("notes", ""),
-        ])
-        total_good += int(r.get("count", 0) or 0)
-        total_def += int(r.get("defects", 0) or 0)
-
-    ws.append(["", "", "", "", "", "Totals", total_good, total_def, ""])
-
-    for col in ws.columns:
-        max_length = 0
-        col_letter = col[0].column_letter  # type: ignore
-        for cell in col:
-            try:
-                max_length = max(max_length, len(str(cell.value)))
-            except Exception:
-                pass
-        ws.column_dimensions[col_letter].width = min(max_length + 2, 40)
 
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
+    # constant_memory flushes each row to disk as it is written, so peak memory
+    # stays flat regardless of how many records the shift has.
+    tmp = tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False)
+    tmp.close()
+    wb = None
+    try:
+        wb = xlsxwriter.Workbook(tmp.name, {"constant_memory": True})
+        ws = wb.add_worksheet(f"{date_str}-Shift-{shift}")
+        ws.write_row(0, 0, headers)
+
+        # column widths are tracked as rows are written; xlsxwriter emits the
+        # column definitions at close, so they can be set after the data
+        widths = [len(h) for h in headers]
+        total_good = 0
+        total_def = 0
+        row_idx = 1
+
+        async for r in records:
+            r_date = r.get("date")
+            r_time = r.get("time")
+            if isinstance(r_date, datetime):
+                r_date_str = _ymd(r_date)
+            else:
+                r_date_str = str(r_date)
+            r_time_str = _hm(r_time) if r_time else ""
+            r_shift, r_line, r_product, r_operator, r_notes = _export_text_fields({**_EXPORT_TEXT_DEFAULTS, **r})
+            count = int(r.get("count") or 0)
+            defects = int(r.get("defects") or 0)
+            total_good += count
+            total_def += defects
+            vals = [
+                r_date_str,
+                r_time_str,
+                r_shift,
+                r_line,
+                r_product,
+                r_operator,
+                count,
+                defects,
+                r_notes,
+            ]
+            ws.write_row(row_idx, 0, vals)
+            for i, v in enumerate(vals):
+                if v is not None:
+                    n = len(str(v))
+                    if n > widths[i]:
+                        widths[i] = n
+            row_idx += 1
+
+        totals_row = ["", "", "", "", "", "Totals", total_good, total_def, ""]
+        ws.write_row(row_idx, 0, totals_row)
+        for i, v in enumerate(totals_row):
+            widths[i] = max(widths[i], len(str(v)))
+
+        for i, w in enumerate(widths):
+            ws.set_column(i, i, min(w + 2, 40))
+        # per-row write_row calls above append to xlsxwriter's row temp file on
+        # the event loop; only the assemble-and-zip step at close, the slow
+        # part, is moved to the threadpool
+        await run_in_threadpool(wb.close)
+    except BaseException:
+        # close() is what removes the worksheet's constant_memory row-data
+        # temp file, so it must run on failure too
+        try:
+            if wb is not None:
+                wb.close()
+        except Exception:
+            pass
+        finally:
+            os.unlink(tmp.name)
+        raise
 
     file_name = f"production_{date_str}_shift_{shift}.xlsx"
-    headers_dict = {
-        'Content-Disposition': f'attachment; filename="{file_name}"'
-    }
-    return StreamingResponse(output, media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', headers=headers_dict)
+    # the temp file is removed once the response has been sent
+    return FileResponse(
+        tmp.name,
+        media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        filename=file_name,
+        background=BackgroundTask(os.unlink, tmp.name),
+    )
 
 
 if __name__ == "__main__":
@@ -44,6 +44,11 @@ class Productionrecord(BaseModel):
     """
     Production records for each entry
     Collection name: "productionrecord" (lowercase of class name)
+
+    Storage: BSON has no date or time-of-day types, so `date` is stored as a
+    datetime at local midnight and `time` as an "HH:MM:SS" string. Queries on
+    `date` must compare against the same midnight datetime. A compound index
+    on (date, shift) is created at API startup.
     """
     date: date = Field(..., description="Production date (local plant date)")
     time: Optional[time] = Field(None, description="Time of the entry (local time)")
@@ -0,0 +1,101 @@
+"""
+Round-trip tests for the production endpoints.
+
+Run against an in-memory Mongo; needs pytest, httpx<0.28 (for the Starlette
+TestClient pinned by fastapi 0.104) and mongomock-motor.
+"""
+
+import io
+import zipfile
+from datetime import datetime
+
+import anyio
+import orjson
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+from fastapi.testclient import TestClient  # noqa: E402
+
+import database  # noqa: E402
+import main  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(database, "async_db", mongomock_motor.AsyncMongoMockClient()["test"])
+    return TestClient(main.app)
+
+
+RECORD = {
+    "date": "2024-01-02",
+    "time": "08:15:30",
+    "line": "L1",
+    "product": "P-100",
+    "operator": "op1",
+    "count": 120,
+    "defects": 3,
+    "notes": "first run",
+}
+
+
+def test_post_then_list_ndjson(client):
+    r = client.post("/api/production", json=RECORD)
+    assert r.status_code == 200
+    body = r.json()
+    assert body["date"] == "2024-01-02"
+    assert body["shift"] == "A"
+
+    r = client.get("/api/production", params={"date_str": "2024-01-02", "shift": "A"})
+    assert r.status_code == 200
+    lines = r.content.splitlines()
+    assert len(lines) == 1
+    doc = orjson.loads(lines[0])
+    assert doc["_id"] == body["id"]
+    assert doc["date"] == "2024-01-02"
+    assert doc["time"] == "08:15"
+    assert doc["shift"] == "A"
+    assert doc["count"] == 120
+    assert doc["defects"] == 3
+    assert doc["notes"] == "first run"
+
+
+def test_post_then_list_json_array(client):
+    client.post("/api/production", json=RECORD)
+    client.post("/api/production", json={**RECORD, "time": "16:00:00"})
+
+    r = client.get("/api/production", params={"date_str": "2024-01-02", "format": "json"})
+    assert r.status_code == 200
+    docs = r.json()
+    assert sorted(d["shift"] for d in docs) == ["A", "B"]
+
+
+def test_unconvertible_record_is_not_dropped(client):
+    client.post("/api/production", json=RECORD)
+    anyio.run(database.async_db["productionrecord"].insert_one, {
+        "date": main.to_bson_date(main._parse_ymd("2024-01-02")), "shift": "A", "count": "lots",
+    })
+
+    r = client.get("/api/production", params={"date_str": "2024-01-02"})
+    assert r.status_code == 200
+    assert len(r.content.splitlines()) == 2
+
+
+
+def _xlsx_text(content: bytes) -> str:
+    with zipfile.ZipFile(io.BytesIO(content)) as z:
+        return "".join(z.read(n).decode() for n in z.namelist() if n.startswith("xl/"))
+
+
+def test_export_tolerates_non_string_time(client):
+    client.post("/api/production", json=RECORD)
+    anyio.run(database.async_db["productionrecord"].insert_one, {
+        "date": main.to_bson_date(main._parse_ymd("2024-01-02")), "shift": "A",
+        "time": datetime(2024, 1, 2, 9, 45), "count": 5, "defects": 1,
+    })
+
+    r = client.get("/api/production/export", params={"date_str": "2024-01-02", "shift": "A"})
+    assert r.status_code == 200
+    text = _xlsx_text(r.content)
+    assert "08:15" in text
+    assert "09:45" in text
+    assert "<v>125</v>" in text and "<v>4</v>" in text